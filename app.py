@@ -1,95 +1,437 @@
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, Response
+from flask.json.provider import DefaultJSONProvider
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from google.auth.transport.requests import Request
-from datetime import datetime, timedelta
+from google.auth.transport.requests import AuthorizedSession, Request
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from datetime import date, datetime, timedelta, timezone
+from dataclasses import dataclass
+from functools import cached_property, lru_cache, partial
+from urllib.parse import quote
+from cachetools import TLRUCache, TTLCache
 from groq import Groq
-import pytz
+import ciso8601
+import hashlib
 import os
-import json
+import re
+import orjson
+import threading
+import time
+import uuid
 from dotenv import load_dotenv
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by orjson.
+    Used for request.json; the messages history Vapi sends
+    grows every turn, so decode/encode speed matters here.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+# Load .env before anything reads the environment: LOG_LEVEL is applied
+# just below and FLASK_DEBUG in __main__. Missing secrets are only an
+# error once get_settings() needs them.
 load_dotenv()
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+app.logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 
-groq_client = Groq(api_key=os.environ['GROQ_API_KEY'])
-CALENDAR_ID = os.environ['CALENDAR_ID']
 
+@dataclass(frozen=True)
+class Settings:
+    """Environment configuration, read once on first use."""
+    groq_api_key: str
+    calendar_id: str
+    google_client_id: str
+    google_client_secret: str
+    google_refresh_token: str
+    # Seconds create_calendar_event() waits on the insert before confirming
+    # anyway. It only always waits for Google's answer if set above the
+    # insert's worst case: CALENDAR_INSERT_TIMEOUT per attempt, times
+    # CALENDAR_INSERT_ATTEMPTS, plus retry backoff (over 30s by default).
+    calendar_insert_wait: float
+
+    @cached_property
+    def calendar_events_url(self):
+        return (
+            'https://www.googleapis.com/calendar/v3/calendars/'
+            f"{quote(self.calendar_id, safe='')}/events"
+        )
+
+
+@lru_cache(maxsize=1)
+def get_settings():
+    """
+    Reads the environment (with .env already loaded) the first time it's
+    needed rather than at import, so importing the app (gunicorn --preload,
+    tooling) doesn't require every secret to be set.
+    """
+    return Settings(
+        groq_api_key=os.environ['GROQ_API_KEY'],
+        calendar_id=os.environ['CALENDAR_ID'],
+        google_client_id=os.environ['GOOGLE_CLIENT_ID'],
+        google_client_secret=os.environ['GOOGLE_CLIENT_SECRET'],
+        google_refresh_token=os.environ['GOOGLE_REFRESH_TOKEN'],
+        calendar_insert_wait=float(os.environ.get('CALENDAR_INSERT_WAIT', '0.3')),
+    )
 
-def get_system_prompt():
-    today = datetime.now(pytz.UTC)
 
-    return f"""You are Tara, a friendly scheduling assistant for Google Calendar.
-Today is {today.strftime('%A, %B %d, %Y')} at {today.strftime('%I:%M %p')} UTC.
+@lru_cache(maxsize=1)
+def get_groq_client():
+    return Groq(api_key=get_settings().groq_api_key)
+
+
+# Extraction stays on the same model as the conversation: it resolves
+# "tomorrow" or "upcoming Monday" into the date that actually gets booked,
+# and its result overrides the tool arguments, so it needs the stronger model
+CHAT_MODEL = "llama-3.3-70b-versatile"
+EXTRACTION_MODEL = CHAT_MODEL
+
+UTC = timezone.utc
+
+# Runs blocking upstream calls (Groq, Google) off the request path so they can
+# overlap. Under the gevent worker these threads are greenlets, so the pool
+# is sized like gunicorn's worker_connections: every conversation a worker
+# holds can have its extraction running without queueing behind the others.
+upstream_pool = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('UPSTREAM_POOL_SIZE', os.environ.get('WORKER_CONNECTIONS', 1000)))
+)
+
+# Calendar inserts get their own pool, so the short wait before confirming
+# is spent on Google's round-trip and not queued behind Groq calls
+calendar_pool = ThreadPoolExecutor(max_workers=8)
+CALENDAR_INSERT_TIMEOUT = 10
+CALENDAR_INSERT_ATTEMPTS = 3
+
+# Confirmations we spoke whose insert failed afterwards, keyed by the call
+# (see call_key()) and the exact confirmation text. Vapi sends that text back
+# in the history, so the next turn of the same call can find it, tell the
+# caller, and stop treating the call as booked. Other calls booking the same
+# slot never see or clear the entry. The value records whether the caller
+# has been told yet.
+failed_bookings = TTLCache(maxsize=1024, ttl=3600)
+failed_bookings_lock = threading.Lock()
+
+# Recent plain-text replies keyed by a hash of the incoming messages, so an
+# identical turn seen again within the TTL skips the Groq round-trip.
+# Opening turns ("hi, I'd like to book a meeting") repeat across calls, so
+# they are keyed on their normalized text instead and kept much longer.
+# Replies are stored without their Groq id; every replay gets a fresh one.
+REPLY_TTL = 30
+OPENING_REPLY_TTL = 3600
+reply_cache = TLRUCache(
+    maxsize=1024,
+    ttu=lambda key, value, now: now + (OPENING_REPLY_TTL if isinstance(key, tuple) else REPLY_TTL)
+)
+reply_cache_lock = threading.Lock()
+
+# extract_info_with_llm() results, keyed by the day plus the user's messages
+# minus bare confirmations; entries outlive a typical call
+extraction_cache = TTLCache(maxsize=1024, ttl=900)
+extraction_cache_lock = threading.Lock()
+EMPTY_EXTRACTION = {
+    'user_name': None,
+    'parsed_date': None,
+    'parsed_time': None,
+    'title': None
+}
+# Extractions currently running, by the same key, so identical concurrent
+# requests share one Groq call instead of each making their own. Followers
+# give up after EXTRACTION_SHARE_WAIT seconds and carry on without one.
+extraction_in_flight = {}
+EXTRACTION_SHARE_WAIT = 15
+# How long a booking path waits on its background extraction before going
+# ahead without it; longer than a follower's wait, which it may include
+EXTRACTION_WAIT = 20
+
+
+# Static instructions go first so every request shares a byte-identical prefix
+# (Groq's prompt caching only matches stable prefixes). Anything that changes
+# per request belongs in the suffix built by get_system_prompt().
+SYSTEM_PROMPT_PREFIX = """You are Tara, a friendly scheduling assistant for Google Calendar.
 
 Help users schedule calendar events by collecting: name, date, time, and optional title.
 
 Be natural and conversational. When user confirms with "yes" or similar, immediately call createCalendarEvent.
 Do not repeat details or apologize - just create the event.
-Times are in UTC."""
+Times are in UTC. Use today's date given below and the current UTC time given at the end of the conversation to resolve relative dates and times."""
 
 
-def get_calendar_service():
-    creds = Credentials(
-        token=None,
-        refresh_token=os.environ['GOOGLE_REFRESH_TOKEN'],
-        client_id=os.environ['GOOGLE_CLIENT_ID'],
-        client_secret=os.environ['GOOGLE_CLIENT_SECRET'],
-        token_uri='https://oauth2.googleapis.com/token',
-        scopes=['https://www.googleapis.com/auth/calendar']
-    )
-    creds.refresh(Request())
-    return build('calendar', 'v3', credentials=creds)
+# Same idea for the extraction call: the fixed instructions lead, and only
+# the date and the user's messages are appended per call
+EXTRACTION_INSTRUCTIONS = """Extract ONLY what the user explicitly said. Return null for anything not explicitly stated by the user.
 
+Return JSON:
+{"name": "string or null", "date": "YYYY-MM-DD or null", "time": "HH:MM (24h) or null", "title": "string or null"}
 
-def extract_info_with_llm(messages):
+Rules:
+- Convert relative dates (tomorrow, upcoming Monday) to actual dates using the date below
+- "4 pm" = 16:00, "4" alone with no am/pm = null (don't assume)
+- Only extract if user EXPLICITLY stated it
+- Return ONLY valid JSON, nothing else"""
+
+GREETING = "Hi! I'm Tara, your scheduling assistant. I'd love to help you book a meeting today! Could I get your full name?"
+
+
+@lru_cache(maxsize=2)
+def _system_prompt_for(date_ordinal):
+    day = date.fromordinal(date_ordinal)
+    return SYSTEM_PROMPT_PREFIX + f"\n\nToday is {day.strftime('%A, %B %d, %Y')}."
+
+
+def get_system_prompt(now):
+    # Only the date goes in here, so the system prompt stays byte-identical
+    # all day and is built at most once per UTC day. The time of day changes
+    # every minute and is sent separately by current_time_message() at the
+    # end of the conversation.
+    return _system_prompt_for(now.toordinal())
+
+
+def current_time_message(now):
+    """
+    Short system message with the current UTC time, appended after the
+    history so everything before it can be served from Groq's prompt cache.
+    """
+    return {'role': 'system', 'content': f"Current time: {now.strftime('%I:%M %p')} UTC."}
+
+
+# Tool schema sent to Groq on every /chat/completions call. Built once at
+# import; the Groq client serializes it without mutating it.
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "createCalendarEvent",
+            "description": "Creates a calendar event. Call after user confirms.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string", "description": "User's name"},
+                    "datetime": {"type": "string", "description": "ISO 8601 datetime (YYYY-MM-DDTHH:MM:SS)"},
+                    "title": {"type": "string", "description": "Meeting title"}
+                },
+                "required": ["name", "datetime"]
+            }
+        }
+    }
+]
+TOOL_CHOICE = "auto"
+
+# A reply counts as a confirmation when it is one of these phrases, alone or
+# followed by a space, comma or period ("yes", "sure, go ahead", "ok.")
+CONFIRMATIONS = ('yes', 'yeah', 'yep', 'sure', 'ok', 'okay', 'sounds good', 'perfect', 'great', 'do it', 'go ahead', 'confirm', 'book it', 'yes please', 'that works', 'correct', 'right', 'absolutely')
+CONFIRMATION_RE = re.compile(r'(?:' + '|'.join(map(re.escape, CONFIRMATIONS)) + r')(?:[ ,.]|\Z)')
+# A message that is nothing but a confirmation phrase carries no details to extract
+CONFIRMATION_ONLY_RE = re.compile(r'(?:' + '|'.join(map(re.escape, CONFIRMATIONS)) + r')[.!,]*\Z')
+# Likewise for filler turns, which speech-to-text produces a lot of
+FILLERS = ('um', 'uh', 'hmm', 'hi', 'hey', 'hello', 'no', 'nope', 'wait', 'sorry')
+FILLER_ONLY_RE = re.compile(r'(?:(?:' + '|'.join(FILLERS) + r')[.!?,]*(?: |\Z))+\Z')
+
+# Anything but letters, digits and apostrophes is dropped when normalizing
+# an opening turn for the reply cache
+NON_WORD_RE = re.compile(r"[^a-z0-9']+")
+
+# Streamed replies are flushed to Vapi at clause boundaries, or once this
+# many characters have built up without one
+PHRASE_BREAK = re.compile(r'[.!?,;:]\s|\n')
+PHRASE_MAX_CHARS = 40
+
+# How much of the conversation is forwarded to Groq each turn, and which
+# message fields are kept per role (everything else Vapi sends is dropped)
+HISTORY_KEEP_LAST = 12
+MESSAGE_FIELDS = {
+    'user': ('role', 'content', 'name'),
+    'assistant': ('role', 'content', 'tool_calls'),
+    'tool': ('role', 'content', 'tool_call_id'),
+}
+
+
+_calendar_session = None
+_calendar_lock = threading.Lock()
+_token_refresh_lock = threading.Lock()
+# After a failed refresh (revoked token, missing GOOGLE_* settings) wait this
+# long before trying again, rather than retrying and logging on every turn
+TOKEN_REFRESH_BACKOFF = 60
+_token_refresh_retry_at = 0.0
+
+
+def get_calendar_session():
+    """
+    Returns an authorized HTTP session for the Calendar API, shared across requests.
+    The session keeps a pool of keep-alive connections so repeat bookings skip
+    the TCP/TLS handshake, and it refreshes the OAuth token on its own only
+    when the token is missing or expired.
+    """
+    global _calendar_session
+
+    with _calendar_lock:
+        if _calendar_session is None:
+            settings = get_settings()
+            creds = Credentials(
+                token=None,
+                refresh_token=settings.google_refresh_token,
+                client_id=settings.google_client_id,
+                client_secret=settings.google_client_secret,
+                token_uri='https://oauth2.googleapis.com/token',
+                scopes=['https://www.googleapis.com/auth/calendar']
+            )
+            session = AuthorizedSession(creds)
+            session.mount('https://', HTTPAdapter(
+                pool_connections=20,
+                pool_maxsize=100,
+                max_retries=Retry(total=CALENDAR_INSERT_ATTEMPTS - 1, backoff_factor=0.2)
+            ))
+            _calendar_session = session
+        return _calendar_session
+
+
+def warm_calendar_token():
+    """
+    Refreshes the Calendar OAuth token ahead of an insert if it is missing
+    or about to expire. Run in the background on turns that may book, so the
+    token round-trip overlaps that turn's Groq calls instead of delaying the
+    booking that follows them. Concurrent callers don't refresh twice.
+    Failures are logged here, since nothing waits on this task; the insert
+    itself still surfaces them to the caller.
+    """
+    global _token_refresh_retry_at
+    if time.monotonic() < _token_refresh_retry_at:
+        return
+    if not _token_refresh_lock.acquire(blocking=False):
+        return
+    try:
+        creds = get_calendar_session().credentials
+        if not creds.valid:
+            creds.refresh(Request())
+    except Exception as e:
+        _token_refresh_retry_at = time.monotonic() + TOKEN_REFRESH_BACKOFF
+        app.logger.error("calendar token refresh failed: %s", e)
+    finally:
+        _token_refresh_lock.release()
+
+
+def warm_upstreams():
+    """
+    Fetches a Calendar token and opens a Groq connection in the background,
+    so a fresh worker's first call doesn't pay for the OAuth round-trip and
+    the TLS handshake. Failures are left for the real request to surface.
+    """
+    upstream_pool.submit(warm_calendar_token)
+    upstream_pool.submit(lambda: get_groq_client().models.list())
+
+
+def await_extraction(extraction):
+    """
+    Waits for a background extract_info_with_llm() call, falling back to an
+    empty extraction rather than holding the turn if it takes too long.
+    """
+    try:
+        return extraction.result(timeout=EXTRACTION_WAIT)
+    except FuturesTimeoutError:
+        app.logger.warning("extraction timed out after %ss", EXTRACTION_WAIT)
+        return dict(EMPTY_EXTRACTION)
+
+
+def extract_info_with_llm(messages, today):
     """
     Uses LLM to intelligently extract name, date, and time from the conversation.
     Only extracts what the USER explicitly said - never from assistant messages.
+    Results are memoized on the user's messages, so a turn that only adds a
+    bare confirmation ("yes", "ok") reuses the previous turn's extraction
+    instead of calling Groq again.
+    `today` is the request's current UTC datetime.
     """
-    today = datetime.now(pytz.UTC)
-    
-    # Only include USER messages for extraction - ignore assistant messages
-    user_messages = "\n".join([
-        msg.get('content', '')
-        for msg in messages
-        if msg.get('role') == 'user' and msg.get('content')
-    ])
-    
-    extraction_prompt = f"""Today is {today.strftime('%A, %B %d, %Y')}.
+    # Only include USER messages for extraction - ignore assistant messages.
+    # One pass collects them and, separately, the ones worth extracting from.
+    user_texts = []
+    substantive_texts = []
+    for msg in messages:
+        content = msg.get('content')
+        if msg.get('role') != 'user' or not content:
+            continue
+        user_texts.append(content)
+        lowered = content.strip().lower()
+        if not (CONFIRMATION_ONLY_RE.match(lowered) or FILLER_ONLY_RE.match(lowered)):
+            substantive_texts.append(content)
 
-Extract ONLY what the user explicitly said. Return null for anything not explicitly stated by the user.
+    # Nothing but confirmations and filler: there is nothing to ask Groq for
+    if not substantive_texts:
+        return dict(EMPTY_EXTRACTION)
 
-USER MESSAGES:
-{user_messages}
+    # Relative dates resolve against today, so the date is part of the key
+    cache_key = hashlib.blake2b(
+        (f"{today.toordinal()}\n" + "\n".join(substantive_texts)).encode(), digest_size=16
+    ).digest()
+    with extraction_cache_lock:
+        cached = extraction_cache.get(cache_key)
+        in_flight = None if cached is not None else extraction_in_flight.get(cache_key)
+        if cached is None and in_flight is None:
+            in_flight = extraction_in_flight[cache_key] = Future()
+            leader = True
+        else:
+            leader = False
+    if cached is not None:
+        return dict(cached)
+    if not leader:
+        # The same conversation is already being extracted by a concurrent
+        # request (e.g. a Vapi retry); share that Groq call's result
+        try:
+            return dict(in_flight.result(timeout=EXTRACTION_SHARE_WAIT))
+        except FuturesTimeoutError:
+            return dict(EMPTY_EXTRACTION)
 
-Return JSON:
-{{"name": "string or null", "date": "YYYY-MM-DD or null", "time": "HH:MM (24h) or null", "title": "string or null"}}
+    try:
+        extracted = _run_extraction("\n".join(user_texts), today)
+        if extracted is not None:
+            with extraction_cache_lock:
+                extraction_cache[cache_key] = extracted
+        else:
+            # Fallback: return empty extraction on error
+            extracted = EMPTY_EXTRACTION
+        in_flight.set_result(extracted)
+        return dict(extracted)
+    finally:
+        with extraction_cache_lock:
+            extraction_in_flight.pop(cache_key, None)
+        # The leader can also be torn down by a BaseException (gevent.Timeout,
+        # GreenletExit); followers must not be left waiting on it
+        if not in_flight.done():
+            in_flight.set_result(EMPTY_EXTRACTION)
 
-Rules:
-- Convert relative dates (tomorrow, upcoming Monday) to actual dates
-- "4 pm" = 16:00, "4" alone with no am/pm = null (don't assume)
-- Only extract if user EXPLICITLY stated it
-- Return ONLY valid JSON, nothing else"""
+
+def _run_extraction(user_messages, today):
+    """
+    Makes the extraction call to Groq and converts its JSON to datetimes.
+    Returns None if the call or the parsing fails.
+    """
+    extraction_prompt = (
+        f"{EXTRACTION_INSTRUCTIONS}\n\n"
+        f"Today is {today.strftime('%A, %B %d, %Y')}.\n\n"
+        f"USER MESSAGES:\n{user_messages}"
+    )
 
     try:
-        response = groq_client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
+        response = get_groq_client().chat.completions.create(
+            model=EXTRACTION_MODEL,
             messages=[{"role": "user", "content": extraction_prompt}],
             temperature=0,
-            max_tokens=200
+            # The reply is one small JSON object
+            max_tokens=120,
+            # JSON mode: Groq guarantees a bare JSON object, no markdown fences
+            response_format={"type": "json_object"}
         )
+        log_usage('extract', response.usage, response.choices[0].finish_reason)
         
-        result_text = response.choices[0].message.content.strip()
-        
-        # Parse JSON from response (handle markdown code blocks)
-        if result_text.startswith("```"):
-            result_text = result_text.split("```")[1]
-            if result_text.startswith("json"):
-                result_text = result_text[4:]
-        result_text = result_text.strip()
-        
-        extracted_json = json.loads(result_text)
+        extracted_json = orjson.loads(response.choices[0].message.content)
         
         # Convert to datetime objects
         extracted = {
@@ -105,7 +447,7 @@ Rules:
         if date_str:
             try:
                 parsed_date = datetime.strptime(date_str, '%Y-%m-%d')
-                extracted['parsed_date'] = pytz.UTC.localize(parsed_date)
+                extracted['parsed_date'] = parsed_date.replace(tzinfo=UTC)
             except ValueError:
                 pass
         
@@ -126,54 +468,90 @@ Rules:
                 )
             except (ValueError, AttributeError):
                 pass
-        
+
         return extracted
         
     except Exception as e:
-        # Fallback: return empty extraction on error
-        return {
-            'user_name': None,
-            'parsed_date': None,
-            'parsed_time': None,
-            'title': None
-        }
+        return None
+
+
+def insert_calendar_event(event_body):
+    """Inserts one event through the shared Calendar session."""
+    resp = get_calendar_session().post(
+        get_settings().calendar_events_url, json=event_body, timeout=CALENDAR_INSERT_TIMEOUT
+    )
+    resp.raise_for_status()
+    return resp
+
+
+def record_failed_insert(booking_key, insert):
+    """
+    Done-callback for inserts that outlived calendar_insert_wait. The caller
+    has already heard the confirmation, so a failure is recorded against
+    `booking_key` (call key, confirmation) for the next turn to correct.
+    """
+    error = insert.exception()
+    if error is not None:
+        app.logger.error("background calendar insert failed: %s", error)
+        with failed_bookings_lock:
+            failed_bookings[booking_key] = False
 
 
-def create_calendar_event(args, messages):
+def create_calendar_event(args, call):
     """
     Creates a Google Calendar event.
     Uses the datetime from args which should already be corrected by server-side parsing.
     NEVER assumes or predicts dates/times - only uses what user explicitly provided.
     """
-    name = args.get('name', 'Guest')
-    datetime_str = args.get('datetime', '')
-    title = args.get('title', f'Meeting with {name}')
+    name = args.get('name')
+    # A datetime when it came from extraction, an ISO string from the model
+    start_arg = args.get('datetime')
+    title = args.get('title')
 
-    # Validation: Ensure we have both date and time
-    if not datetime_str:
-        return "I need both a date and time to create the event. Please provide the time."
+    # Validate everything up front so bad tool arguments never cost an
+    # OAuth refresh or a Calendar API call
+    if not isinstance(name, str) or not name.strip():
+        return "I didn't catch your name. Could you tell me your name?"
+    name = name.strip()
 
-    try:
-        # Handle both with and without timezone
-        if datetime_str.endswith('Z'):
-            datetime_str = datetime_str.replace('Z', '+00:00')
-        start = datetime.fromisoformat(datetime_str)
-    except ValueError:
-        return "I couldn't parse that date and time. Please provide a valid date and time."
+    if not isinstance(title, str) or not title.strip():
+        title = f'Meeting with {name}'
 
-    if start.tzinfo is None:
-        start = start.replace(tzinfo=pytz.UTC)
+    if isinstance(start_arg, datetime):
+        # Already parsed: extracted datetimes are passed through as-is
+        # rather than round-tripped through isoformat() and back
+        start = start_arg
     else:
-        # Ensure it's in UTC
-        start = start.astimezone(pytz.UTC)
+        # Ensure we have both date and time
+        if not isinstance(start_arg, str) or not start_arg.strip():
+            return "I need both a date and time to create the event. Please provide the time."
+        datetime_str = start_arg.strip()
+
+        try:
+            # Fast C parser; handles 'Z' and with/without timezone
+            start = ciso8601.parse_datetime(datetime_str)
+        except ValueError:
+            try:
+                # Fall back for anything ciso8601 is stricter about
+                if datetime_str.endswith('Z'):
+                    datetime_str = datetime_str.replace('Z', '+00:00')
+                start = datetime.fromisoformat(datetime_str)
+            except ValueError:
+                return "I couldn't parse that date and time. Please provide a valid date and time."
+
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=UTC)
+    elif start.tzinfo is not UTC:
+        # Ensure it's in UTC; extracted datetimes already carry UTC itself,
+        # so the common direct-create path skips the conversion
+        start = start.astimezone(UTC)
 
-    now = datetime.now(pytz.UTC)
+    now = datetime.now(UTC)
     if start < now:
         return "I'm sorry, that date and time has already passed. Please choose a future date and time."
 
     try:
         end = start + timedelta(hours=1)
-        service = get_calendar_service()
 
         event_body = {
             'summary': title,
@@ -188,56 +566,367 @@ def create_calendar_event(args, messages):
             },
         }
 
-        service.events().insert(
-            calendarId=CALENDAR_ID,
-            body=event_body
-        ).execute()
-
-        return (
+        confirmation = (
             f"Done! I've created '{title}' for {name} on "
             f"{start.strftime('%A, %B %d, %Y at %I:%M %p')} UTC. "
             f"You're all set!"
         )
 
+        # Don't hold the confirmation on Google's full round-trip: wait
+        # briefly so fast failures (bad request, auth) are still reported,
+        # then confirm and let a slow insert finish in the background. A
+        # rebook in this call can repeat an earlier failed confirmation word
+        # for word, so that record is cleared; this booking stands on its own.
+        booking_key = (call, confirmation)
+        with failed_bookings_lock:
+            failed_bookings.pop(booking_key, None)
+        insert = calendar_pool.submit(insert_calendar_event, event_body)
+        try:
+            insert.result(timeout=get_settings().calendar_insert_wait)
+        except FuturesTimeoutError:
+            insert.add_done_callback(partial(record_failed_insert, booking_key))
+
+        return confirmation
+
     except Exception as e:
         return f"Sorry, there was an error creating your event: {str(e)}"
 
 
-def stream_text(text, response_id):
-    """
-    Streams text word by word in OpenAI SSE format.
-    Why: Vapi needs streaming for real-time speech output.
-    """
-    words = text.split(' ')
-    for i, word in enumerate(words):
-        chunk_content = word + ('' if i == len(words) - 1 else ' ')
-        chunk_data = {
-            "id": response_id,
-            "object": "chat.completion.chunk",
-            "created": int(datetime.now().timestamp()),
-            "model": "llama-3.3-70b-versatile",
-            "choices": [
-                {
-                    "index": 0,
-                    "delta": {
-                        "role": "assistant",
-                        "content": chunk_content
-                    },
-                    "finish_reason": None
-                }
-            ]
-        }
-        yield f"data: {json.dumps(chunk_data)}\n\n"
+def compact_history(messages, keep_last=HISTORY_KEEP_LAST):
+    """
+    Trims the conversation sent to Groq: drops system messages, keeps the
+    first user message plus the last `keep_last` messages, and strips fields
+    Groq doesn't use. Prompt tokens, and so latency and cost, no longer grow
+    with the length of the call.
+    """
+    # Vapi puts its system message first; slicing it off avoids copying the
+    # whole conversation. Any other system message is dropped below.
+    history = messages[1:] if messages and messages[0].get('role') == 'system' else messages
+
+    if len(history) > keep_last:
+        tail = history[-keep_last:]
+        # A tool result can't lead the window without the call that produced it
+        while tail and tail[0].get('role') == 'tool':
+            tail = tail[1:]
+        first_user = next((i for i, m in enumerate(history) if m.get('role') == 'user'), None)
+        if first_user is not None and first_user < len(history) - len(tail):
+            tail = [history[first_user]] + tail
+        history = tail
+
+    return [
+        {k: m[k] for k in MESSAGE_FIELDS.get(m.get('role'), ('role', 'content')) if k in m}
+        for m in history
+        if m.get('role') != 'system'
+    ]
+
+
+def log_usage(call, usage, finish_reason):
+    """
+    Logs token usage for one Groq call, including how much of the prompt was
+    served from Groq's prompt cache, so prompt-prefix changes can be checked
+    against real traffic.
+    """
+    if usage is None:
+        return
+
+    prompt = getattr(usage, 'prompt_tokens', None) or 0
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached = getattr(details, 'cached_tokens', None) or 0
+    app.logger.info("groq usage %s", orjson.dumps({
+        "call": call,
+        "prompt": prompt,
+        "cached": cached,
+        "completion": getattr(usage, 'completion_tokens', None) or 0,
+        "hit_rate": round(cached / prompt, 3) if prompt else 0.0,
+        "finish_reason": finish_reason,
+    }).decode())
+
 
+def request_completion(messages, stream):
+    """Calls Groq for Tara's next turn with the calendar tool available."""
+    return get_groq_client().chat.completions.create(
+        model=CHAT_MODEL,
+        messages=messages,
+        tools=TOOLS,
+        tool_choice=TOOL_CHOICE,
+        temperature=0.3,
+        max_tokens=1000,
+        stream=stream
+    )
+
+
+def call_key(data, messages):
+    """
+    Identifies the call a request belongs to, for per-call state such as
+    failed_bookings. Vapi's call id when it sends one; otherwise a digest
+    of the conversation up to the caller's first message, which every
+    later turn of the call repeats.
+    """
+    call_id = (data.get('call') or {}).get('id')
+    if call_id:
+        return call_id
+    first_user = next(
+        (i for i, m in enumerate(messages) if m.get('role') == 'user'), len(messages) - 1
+    )
+    return hashlib.blake2b(orjson.dumps(messages[:first_user + 1]), digest_size=16).digest()
+
+
+def event_already_created(messages, call):
+    """
+    Whether we already confirmed a booking in this conversation whose insert
+    hasn't since failed. Scans from the end, since the confirmation is
+    usually among the most recent assistant messages, and stops at the
+    first match.
+    """
+    with failed_bookings_lock:
+        return any(
+            msg.get('role') == 'assistant'
+            and "Done! I've created" in (content := msg.get('content') or '')
+            and (call, content) not in failed_bookings
+            for msg in reversed(messages)
+        )
+
+
+def take_failed_booking(messages, call):
+    """
+    Returns True, once, if a booking we confirmed in this conversation
+    turned out to fail in the background and the caller hasn't been told.
+    """
+    with failed_bookings_lock:
+        for msg in reversed(messages):
+            booking_key = (call, msg.get('content') or '')
+            if msg.get('role') == 'assistant' and failed_bookings.get(booking_key) is False:
+                failed_bookings[booking_key] = True
+                return True
+    return False
+
+
+def handle_tool_call(arguments, extracted, messages, call):
+    """
+    Runs a createCalendarEvent tool call and returns the text to speak.
+    Date, time, name and title the user stated (from extract_info_with_llm)
+    take precedence over what the model put in the arguments.
+    """
+    # Check if event was already created in this conversation (prevent duplicates)
+    if event_already_created(messages, call):
+        # Event already created - just acknowledge
+        return "Your event has already been created! Is there anything else I can help you with?"
+
+    args = orjson.loads(arguments)
+
+    # Only use extracted date/time if it's valid (not midnight which indicates no real time)
+    has_valid_extracted_time = (
+        extracted['parsed_time'] and 
+        extracted['parsed_date'] and
+        not (extracted['parsed_time'].hour == 0 and extracted['parsed_time'].minute == 0)
+    )
+
+    if has_valid_extracted_time:
+        args['datetime'] = extracted['parsed_time']
+    elif extracted['parsed_date']:
+        # We have date but no time - use date with time from tool call args
+        datetime_str = args.get('datetime', '')
+        try:
+            parsed_from_args = datetime.fromisoformat(datetime_str.replace('Z', '+00:00'))
+            # Check if tool call has a real time (not midnight)
+            if parsed_from_args.hour != 0 or parsed_from_args.minute != 0:
+                combined_datetime = extracted['parsed_date'].replace(
+                    hour=parsed_from_args.hour,
+                    minute=parsed_from_args.minute,
+                    second=0,
+                    microsecond=0
+                )
+                args['datetime'] = combined_datetime
+        except:
+            pass
+
+    # Use extracted name and title if available
+    if extracted['user_name']:
+        args['name'] = extracted['user_name']
+    if extracted.get('title'):
+        args['title'] = extracted['title']
+
+    return create_calendar_event(args, call)
+
+
+def sse_chunk_prefix(response_id, created):
+    """
+    Returns the bytes of an OpenAI-style SSE content chunk up to the
+    content value. Everything but the content is the same for every chunk
+    of a stream, so it is encoded once and reused.
+    """
+    return (
+        b'data: {"id":' + orjson.dumps(response_id)
+        + b',"object":"chat.completion.chunk","created":' + str(created).encode()
+        + b',"model":' + orjson.dumps(CHAT_MODEL) + b',"choices":[{"index":0,'
+        + b'"delta":{"role":"assistant","content":'
+    )
+
+
+SSE_CHUNK_SUFFIX = b'},"finish_reason":null}]}\n\n'
+
+
+def sse_chunk(prefix, content):
+    """
+    Formats one SSE content chunk from a prefix made by sse_chunk_prefix().
+    Only the content itself is JSON-encoded per chunk.
+    """
+    return prefix + orjson.dumps(content) + SSE_CHUNK_SUFFIX
+
+
+def sse_done(response_id, created):
+    """Formats the final stop chunk followed by the [DONE] sentinel."""
     done_data = {
         "id": response_id,
         "object": "chat.completion.chunk",
-        "created": int(datetime.now().timestamp()),
-        "model": "llama-3.3-70b-versatile",
+        "created": created,
+        "model": CHAT_MODEL,
         "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
     }
-    yield f"data: {json.dumps(done_data)}\n\n"
-    yield "data: [DONE]\n\n"
+    return b"data: " + orjson.dumps(done_data) + b"\n\ndata: [DONE]\n\n"
+
+
+def stream_text(text, response_id, created):
+    """
+    Streams already-complete text in OpenAI SSE format.
+    Why: Vapi needs streaming for real-time speech output. There is nothing
+    to wait for here, so the whole text goes out as a single content chunk,
+    written together with the stop chunk and [DONE].
+    """
+    yield sse_chunk(sse_chunk_prefix(response_id, created), text) + sse_done(response_id, created)
+
+
+def phrase_end(text):
+    """
+    Returns how much of `text` is ready to send as one SSE chunk: everything
+    up to the last clause break, all of it once it's grown past
+    PHRASE_MAX_CHARS, or 0 to keep buffering.
+    """
+    cut = 0
+    for match in PHRASE_BREAK.finditer(text):
+        cut = match.end()
+    if not cut and len(text) >= PHRASE_MAX_CHARS:
+        cut = len(text)
+    return cut
+
+
+def stream_completion(completion, messages, call, extraction, reply_key, created):
+    """
+    Relays a streaming Groq completion to Vapi in OpenAI SSE format.
+    Text deltas are forwarded as soon as they arrive. If the model calls
+    createCalendarEvent instead, its arguments are collected from the stream,
+    the event is created once the stream ends, and the confirmation is
+    streamed in place of the model's text.
+    """
+    response_id = "chat-stream"
+    prefix = sse_chunk_prefix(response_id, created)
+    content_parts = []
+    pending = ""
+    tool_arguments = []
+    tool_called = False
+    usage = None
+    finish_reason = None
+
+    try:
+        for chunk in completion:
+            # Groq sends the same id on every chunk, so this runs once
+            if chunk.id and chunk.id != response_id:
+                response_id = chunk.id
+                prefix = sse_chunk_prefix(response_id, created)
+            # Groq reports usage on the final chunk under x_groq
+            x_groq = getattr(chunk, 'x_groq', None)
+            if x_groq is not None and getattr(x_groq, 'usage', None) is not None:
+                usage = x_groq.usage
+            if not chunk.choices:
+                continue
+            finish_reason = chunk.choices[0].finish_reason or finish_reason
+            delta = chunk.choices[0].delta
+
+            if delta.tool_calls:
+                tool_called = True
+                for tc in delta.tool_calls:
+                    # Only the first tool call is executed, as in the non-streaming path
+                    if tc.index == 0 and tc.function and tc.function.arguments:
+                        tool_arguments.append(tc.function.arguments)
+            elif delta.content:
+                content_parts.append(delta.content)
+                pending += delta.content
+                # Send whole phrases rather than single tokens: fewer SSE
+                # events, and Vapi's TTS gets clause-sized input
+                cut = phrase_end(pending)
+                if cut:
+                    yield sse_chunk(prefix, pending[:cut])
+                    pending = pending[cut:]
+
+        if pending:
+            yield sse_chunk(prefix, pending)
+
+        log_usage('chat-stream', usage, finish_reason)
+
+        if tool_called:
+            confirmation = handle_tool_call(''.join(tool_arguments), await_extraction(extraction), messages, call)
+            yield from stream_text(confirmation, response_id, created)
+            return
+
+        if reply_key is not None:
+            with reply_cache_lock:
+                reply_cache[reply_key] = ("".join(content_parts), CHAT_MODEL)
+
+    except Exception:
+        # Headers are already sent, so there is no status code left to set;
+        # say something Vapi can speak instead of cutting the stream off
+        yield sse_chunk(prefix, "Sorry, something went wrong on my end. Could you say that again?")
+
+    yield sse_done(response_id, created)
+
+
+def json_response(obj, status=200):
+    """
+    Returns orjson bytes as-is instead of going through jsonify(), which
+    would decode them to str and re-encode.
+    """
+    return Response(orjson.dumps(obj), status=status, mimetype='application/json')
+
+
+def sse_response(events):
+    """
+    Wraps an SSE generator in a streaming Response. direct_passthrough
+    hands the byte chunks to the server as-is instead of running each one
+    through Werkzeug's iterable wrapping.
+    """
+    return Response(
+        events,
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        direct_passthrough=True
+    )
+
+
+def text_response(content, response_id, model, stream, created):
+    """
+    Returns a plain assistant reply in the shape Vapi expects:
+    SSE chunks when streaming, a single chat.completion otherwise.
+    """
+    if stream:
+        return sse_response(stream_text(content, response_id, created))
+
+    return json_response({
+        "id": response_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": content,
+                    "tool_calls": None
+                },
+                "finish_reason": "stop"
+            }
+        ]
+    })
 
 
 @app.route('/')
@@ -254,10 +943,11 @@ def chat():
     1. Extract information from conversation (name, date, time)
     2. Parse dates/times server-side to avoid LLM hallucination
     3. Inject parsed info into system prompt
-    4. Call Groq non-streaming to get full response
+    4. Call Groq (streaming when Vapi asks for it)
+       (runs concurrently with step 1 unless the user just confirmed)
     5. If tool call detected -> create calendar event directly here
        -> return confirmation as streamed text to Vapi
-    6. If regular text -> stream it to Vapi
+    6. If regular text -> relay Groq's tokens to Vapi as they arrive
 
     Why handle tool calls here instead of /create-event:
     Vapi's Custom LLM provider does not forward tool calls
@@ -268,10 +958,23 @@ def chat():
         data = request.json
         messages = data.get('messages', [])
         stream = data.get('stream', False)
+        # One clock read for the whole request: prompt date, time line,
+        # cache keys, the extraction and every response timestamp agree on it
+        now = datetime.now(UTC)
+        created = int(now.timestamp())
+
+        # Nothing has been said yet (Vapi opening the call): the greeting is
+        # always the same, so answer it without calling Groq at all
+        if not any(m.get('role') != 'system' and (m.get('content') or '').strip() for m in messages):
+            return text_response(GREETING, "greeting", CHAT_MODEL, stream, created)
+
+        # A booking we confirmed earlier failed after the fact: say so before
+        # anything else, so the caller can book it again
+        call = call_key(data, messages)
+        if take_failed_booking(messages, call):
+            booking_failed = "I'm sorry, I wasn't able to save your event to the calendar after all. Would you like me to try booking it again?"
+            return text_response(booking_failed, "booking-failed", CHAT_MODEL, stream, created)
 
-        # Extract information from conversation using LLM (simple and reliable)
-        extracted = extract_info_with_llm(messages)
-        
         # Check if user just confirmed (yes, ok, sure, etc.) and we have all info
         # If so, skip the LLM and create the event directly
         last_user_msg = ""
@@ -280,211 +983,132 @@ def chat():
                 last_user_msg = msg.get('content', '').strip().lower()
                 break
         
-        confirmations = ['yes', 'yeah', 'yep', 'sure', 'ok', 'okay', 'sounds good', 'perfect', 'great', 'do it', 'go ahead', 'confirm', 'book it', 'yes please', 'that works', 'correct', 'right', 'absolutely']
-        is_confirmation = any(last_user_msg == c or last_user_msg.startswith(c + ' ') or last_user_msg.startswith(c + ',') or last_user_msg.startswith(c + '.') for c in confirmations)
-        
+        is_confirmation = CONFIRMATION_RE.match(last_user_msg) is not None
+
+        # Replay the reply to an identical turn we answered moments ago
+        # (Vapi retries, duplicate requests), or to the same opening line
+        # from an earlier call. Confirmations are never cached since they
+        # may create an event.
+        reply_key = None
+        if not is_confirmation:
+            user_turns = sum(1 for m in messages if m.get('role') == 'user' and m.get('content'))
+            if user_turns == 1 and messages[-1].get('role') == 'user':
+                # The reply can still depend on today's date and the
+                # current-time line (bucketed by hour), and on whatever the
+                # assistant said before the caller spoke
+                preamble = tuple(
+                    m.get('content') or '' for m in messages
+                    if m.get('role') == 'assistant'
+                )
+                reply_key = (
+                    now.toordinal(), now.hour, preamble,
+                    ' '.join(NON_WORD_RE.sub(' ', last_user_msg).split()),
+                )
+            else:
+                reply_key = hashlib.blake2b(orjson.dumps(messages), digest_size=16).digest()
+            with reply_cache_lock:
+                cached_reply = reply_cache.get(reply_key)
+            if cached_reply is not None:
+                content, model = cached_reply
+                return text_response(content, f"chatcmpl-{uuid.uuid4().hex}", model, stream, created)
+
+        # Check if already created (prevent duplicates). Once it has been,
+        # every booking path answers with that, so a confirmation gets the
+        # answer straight away and nothing needs extracting.
+        already_created = event_already_created(messages, call)
+        if is_confirmation and already_created:
+            already_done = "Your event has already been created! Is there anything else I can help you with?"
+            if stream:
+                return sse_response(stream_text(already_done, "already-done", created))
+            return json_response({
+                "id": "already-done",
+                "object": "chat.completion",
+                "created": created,
+                "model": CHAT_MODEL,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": already_done}, "finish_reason": "stop"}]
+            })
+
+        # Extract information from conversation using LLM (simple and reliable).
+        # Started in the background so it overlaps with the main completion
+        # below; only the confirmation short-circuit and the tool-call path
+        # actually wait on it.
+        if already_created:
+            extraction = Future()
+            extraction.set_result(EMPTY_EXTRACTION)
+        else:
+            extraction = upstream_pool.submit(extract_info_with_llm, messages, now)
+            # Either booking path (direct create or a tool call at the end of
+            # the completion) may need the token; get it alongside the Groq
+            # calls. The task only refreshes when the token is stale.
+            upstream_pool.submit(warm_calendar_token)
+
         # Only create directly if we have ALL required info: name, date, AND a real time (not midnight)
-        has_valid_time = (
-            extracted['parsed_time'] and 
-            extracted['parsed_date'] and
-            not (extracted['parsed_time'].hour == 0 and extracted['parsed_time'].minute == 0)  # Exclude midnight as likely invalid
-        )
+        has_valid_time = False
+        if is_confirmation:
+            extracted = await_extraction(extraction)
+            has_valid_time = (
+                extracted['parsed_time'] and 
+                extracted['parsed_date'] and
+                not (extracted['parsed_time'].hour == 0 and extracted['parsed_time'].minute == 0)  # Exclude midnight as likely invalid
+            )
         
         if is_confirmation and has_valid_time and extracted['user_name']:
-            # Check if already created (prevent duplicates)
-            for msg in messages:
-                if msg.get('role') == 'assistant' and "Done! I've created" in msg.get('content', ''):
-                    already_done = "Your event has already been created! Is there anything else I can help you with?"
-                    if stream:
-                        return Response(
-                            stream_text(already_done, "already-done"),
-                            mimetype='text/event-stream',
-                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
-                        )
-                    return jsonify({
-                        "id": "already-done",
-                        "object": "chat.completion",
-                        "created": int(datetime.now().timestamp()),
-                        "model": "llama-3.3-70b-versatile",
-                        "choices": [{"index": 0, "message": {"role": "assistant", "content": already_done}, "finish_reason": "stop"}]
-                    })
-            
             # User confirmed and we have all info - create event directly
             args = {
                 'name': extracted['user_name'],
-                'datetime': extracted['parsed_time'].isoformat(),
+                'datetime': extracted['parsed_time'],
                 'title': extracted.get('title') or f"Meeting with {extracted['user_name']}"
             }
-            confirmation = create_calendar_event(args, messages)
+            confirmation = create_calendar_event(args, call)
             
             if stream:
-                return Response(
-                    stream_text(confirmation, "direct-create"),
-                    mimetype='text/event-stream',
-                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
-                )
-            return jsonify({
+                return sse_response(stream_text(confirmation, "direct-create", created))
+            return json_response({
                 "id": "direct-create",
                 "object": "chat.completion",
-                "created": int(datetime.now().timestamp()),
-                "model": "llama-3.3-70b-versatile",
+                "created": created,
+                "model": CHAT_MODEL,
                 "choices": [{"index": 0, "message": {"role": "assistant", "content": confirmation}, "finish_reason": "stop"}]
             })
         
-        # Replace Vapi's system message with ours
-        messages = [m for m in messages if m.get('role') != 'system']
-        messages = [{'role': 'system', 'content': get_system_prompt()}] + messages
+        # Replace Vapi's system message with ours and send Groq a trimmed
+        # history. The full `messages` list is kept for the duplicate-event
+        # check, which must see the whole conversation.
+        history = [{'role': 'system', 'content': get_system_prompt(now)}]
+        history.extend(compact_history(messages))
+        history.append(current_time_message(now))
 
-        tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "createCalendarEvent",
-                    "description": "Creates a calendar event. Call after user confirms.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "name": {"type": "string", "description": "User's name"},
-                            "datetime": {"type": "string", "description": "ISO 8601 datetime (YYYY-MM-DDTHH:MM:SS)"},
-                            "title": {"type": "string", "description": "Meeting title"}
-                        },
-                        "required": ["name", "datetime"]
-                    }
-                }
-            }
-        ]
-
-        # Always call Groq non-streaming first so we can inspect the response
-        response = groq_client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=messages,
-            tools=tools,
-            tool_choice="auto",
-            temperature=0.3,
-            max_tokens=1000,
-            stream=False
-        )
+        # Streaming: relay Groq's tokens to Vapi as they arrive instead of
+        # waiting for the whole completion. Tool calls are still collected
+        # and handled here once the stream ends.
+        if stream:
+            completion = request_completion(history, stream=True)
+            return sse_response(stream_completion(completion, messages, call, extraction, reply_key, created))
 
-        choice = response.choices[0]
-        message = choice.message
+        response = request_completion(history, stream=False)
+        log_usage('chat', response.usage, response.choices[0].finish_reason)
+        message = response.choices[0].message
 
         # CASE 1: Tool call detected
         # Create the calendar event directly here and return confirmation as text
         if message.tool_calls:
-            # Check if event was already created in this conversation (prevent duplicates)
-            for msg in messages:
-                content = msg.get('content', '')
-                if msg.get('role') == 'assistant' and "Done! I've created" in content:
-                    # Event already created - just acknowledge
-                    already_done = "Your event has already been created! Is there anything else I can help you with?"
-                    if stream:
-                        return Response(
-                            stream_text(already_done, response.id),
-                            mimetype='text/event-stream',
-                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
-                        )
-                    return jsonify({
-                        "id": response.id,
-                        "object": "chat.completion",
-                        "created": int(datetime.now().timestamp()),
-                        "model": response.model,
-                        "choices": [{"index": 0, "message": {"role": "assistant", "content": already_done}, "finish_reason": "stop"}]
-                    })
-            
-            tc = message.tool_calls[0]
-            args = json.loads(tc.function.arguments)
-            
-            # Only use extracted date/time if it's valid (not midnight which indicates no real time)
-            has_valid_extracted_time = (
-                extracted['parsed_time'] and 
-                extracted['parsed_date'] and
-                not (extracted['parsed_time'].hour == 0 and extracted['parsed_time'].minute == 0)
+            confirmation = handle_tool_call(
+                message.tool_calls[0].function.arguments, await_extraction(extraction), messages, call
             )
-            
-            if has_valid_extracted_time:
-                args['datetime'] = extracted['parsed_time'].isoformat()
-            elif extracted['parsed_date']:
-                # We have date but no time - use date with time from tool call args
-                datetime_str = args.get('datetime', '')
-                try:
-                    parsed_from_args = datetime.fromisoformat(datetime_str.replace('Z', '+00:00'))
-                    # Check if tool call has a real time (not midnight)
-                    if parsed_from_args.hour != 0 or parsed_from_args.minute != 0:
-                        combined_datetime = extracted['parsed_date'].replace(
-                            hour=parsed_from_args.hour,
-                            minute=parsed_from_args.minute,
-                            second=0,
-                            microsecond=0
-                        )
-                        args['datetime'] = combined_datetime.isoformat()
-                except:
-                    pass
-            
-            # Use extracted name and title if available
-            if extracted['user_name']:
-                args['name'] = extracted['user_name']
-            if extracted.get('title'):
-                args['title'] = extracted['title']
-            
-            confirmation = create_calendar_event(args, messages)
+            return text_response(confirmation, response.id, response.model, stream, created)
 
-            if stream:
-                return Response(
-                    stream_text(confirmation, response.id),
-                    mimetype='text/event-stream',
-                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
-                )
-
-            return jsonify({
-                "id": response.id,
-                "object": "chat.completion",
-                "created": int(datetime.now().timestamp()),
-                "model": response.model,
-                "choices": [
-                    {
-                        "index": 0,
-                        "message": {
-                            "role": "assistant",
-                            "content": confirmation,
-                            "tool_calls": None
-                        },
-                        "finish_reason": "stop"
-                    }
-                ]
-            })
-
-        # CASE 2: Regular text response — stream it
+        # CASE 2: Regular text response
         content = message.content or ""
+        if reply_key is not None:
+            with reply_cache_lock:
+                reply_cache[reply_key] = (content, response.model)
 
-        if stream:
-            return Response(
-                stream_text(content, response.id),
-                mimetype='text/event-stream',
-                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
-            )
-
-        # CASE 3: Non-streaming fallback
-        return jsonify({
-            "id": response.id,
-            "object": "chat.completion",
-            "created": int(datetime.now().timestamp()),
-            "model": response.model,
-            "choices": [
-                {
-                    "index": 0,
-                    "message": {
-                        "role": "assistant",
-                        "content": content,
-                        "tool_calls": None
-                    },
-                    "finish_reason": "stop"
-                }
-            ]
-        })
+        return text_response(content, response.id, response.model, stream, created)
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}, status=500)
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    # Local development only; production runs under gunicorn (see gunicorn.conf.py)
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1')
\ No newline at end of file
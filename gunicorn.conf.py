@@ -0,0 +1,28 @@
+# Gunicorn picks this file up automatically from the working directory,
+# so the Procfile can stay as `gunicorn app:app`.
+#
+# Both Groq and Google Calendar calls are blocking network I/O, so gevent
+# workers let each process keep many conversations in flight instead of
+# serializing them behind one another.
+#
+# The app is preloaded in the master so its imports are shared copy-on-write
+# across workers. That means app.py is imported before any worker starts, so
+# patch here first; otherwise its module-level locks and sockets would be
+# the unpatched, blocking kind.
+from gevent import monkey
+monkey.patch_all()
+
+import multiprocessing
+import os
+
+worker_class = 'gevent'
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
+preload_app = True
+
+
+def post_worker_init(worker):
+    # Connections and tokens can't be shared across the fork, so each worker
+    # warms its own before taking traffic
+    from app import warm_upstreams
+    warm_upstreams()